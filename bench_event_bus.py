@@ -0,0 +1,140 @@
+"""事件总线微基准测试
+
+测量 EventBus 的发布/分发吞吐量、排队延迟、拥塞时关机事件的排队延迟、
+慢订阅者对其他订阅者的影响，以及各种队列溢出策略在突发流量下的丢弃/合并情况。
+在非 Windows 环境下通过 win_sim 提供的假模块导入 main.py。
+
+用法:
+    python bench_event_bus.py --events 100000
+"""
+import time
+import logging
+import argparse
+import threading
+
+from win_sim import SimulatedWindows
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))] * 1000
+
+
+def bench_throughput(main, count):
+    # 单个发布者、空订阅者：测量吞吐量和排队延迟
+    bus = main.EventBus(max_size=count)
+    latencies = []
+    done = threading.Event()
+
+    def subscriber(event):
+        latencies.append(time.perf_counter() - event.published_at)
+        if len(latencies) == count:
+            done.set()
+
+    bus.subscribe(subscriber)
+    bus.start()
+    start = time.perf_counter()
+    for _ in range(count):
+        bus.publish(main.SystemEvent(main.EventType.TEST))
+    publish_elapsed = time.perf_counter() - start
+    done.wait()
+    total_elapsed = time.perf_counter() - start
+    bus.stop()
+
+    print(f"吞吐量: 发布 {count / publish_elapsed:,.0f} 事件/秒, 发布+分发 {count / total_elapsed:,.0f} 事件/秒")
+    print(f"排队延迟: p50 {percentile(latencies, 0.5):.3f}ms, p95 {percentile(latencies, 0.95):.3f}ms, "
+          f"p99 {percentile(latencies, 0.99):.3f}ms")
+
+
+def bench_priority(main, backlog, handle_ms):
+    # 慢订阅者正在处理开机事件、且有积压时：测量关机事件的排队延迟
+    bus = main.EventBus(max_size=backlog + 2)
+    queued_for = {}
+    started = threading.Event()
+
+    def subscriber(event):
+        queued_for.setdefault(event.type, []).append(time.perf_counter() - event.published_at)
+        if event.type == main.EventType.BOOT:
+            started.set()
+            time.sleep(handle_ms / 1000)
+
+    bus.subscribe(subscriber)
+    bus.start()
+    # 第一个开机事件正在处理，其余开机事件在队列中积压
+    bus.publish(main.SystemEvent(main.EventType.BOOT))
+    started.wait()
+    for _ in range(backlog):
+        bus.publish(main.SystemEvent(main.EventType.BOOT))
+    shutdown = bus.publish(main.SystemEvent(main.EventType.SHUTDOWN))
+    shutdown.wait()
+    bus.stop()
+
+    print(f"优先级: 开机事件处理中、另积压 {backlog} 个、每个处理 {handle_ms}ms 时，"
+          f"关机事件排队 {queued_for[main.EventType.SHUTDOWN][0] * 1000:.3f}ms "
+          f"(按先进先出需约 {(backlog + 1) * handle_ms}ms)")
+
+
+def bench_isolation(main, count, handle_ms):
+    # 一个慢订阅者和一个快订阅者：测量快订阅者的排队延迟是否受慢订阅者影响
+    bus = main.EventBus(max_size=count)
+    latencies = []
+    done = threading.Event()
+
+    def fast(event):
+        latencies.append(time.perf_counter() - event.published_at)
+        if len(latencies) == count:
+            done.set()
+
+    bus.subscribe(lambda event: time.sleep(handle_ms / 1000))
+    bus.subscribe(fast)
+    bus.start()
+    for _ in range(count):
+        bus.publish(main.SystemEvent(main.EventType.BOOT))
+    done.wait()
+    bus.stop()
+
+    print(f"订阅者隔离: 慢订阅者每个事件 {handle_ms}ms 时，快订阅者 {count} 个事件排队 "
+          f"p95 {percentile(latencies, 0.95):.3f}ms, max {max(latencies) * 1000:.3f}ms")
+
+
+def bench_overflow(main, capacity, burst):
+    # 订阅者阻塞时突发发布：比较各溢出策略
+    for policy in main.EventBus.OVERFLOW_POLICIES:
+        bus = main.EventBus(max_size=capacity, overflow=policy)
+        gate = threading.Event()
+        bus.subscribe(lambda event: gate.wait())
+        bus.start()
+        types = [main.EventType.BOOT, main.EventType.TEST, main.EventType.SLEEP, main.EventType.RESUME]
+        start = time.perf_counter()
+        for i in range(burst):
+            bus.publish(main.SystemEvent(types[i % len(types)]))
+        shutdown = bus.publish(main.SystemEvent(main.EventType.SHUTDOWN))
+        elapsed = time.perf_counter() - start
+        stats = bus.get_stats()
+        gate.set()
+        bus.stop()
+        print(f"溢出策略 {policy:<12} 发布 {burst + 1} 个: 丢弃 {stats['dropped']}, 合并 {stats['coalesced']}, "
+              f"队列 {stats['queue_size']}, 关机事件{'被丢弃' if shutdown is None or shutdown.dropped else '已排队'}, "
+              f"{(burst + 1) / elapsed:,.0f} 事件/秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="事件总线微基准测试")
+    parser.add_argument('--events', type=int, default=100000, help="吞吐量测试的事件数")
+    parser.add_argument('--backlog', type=int, default=200, help="优先级测试中积压的事件数")
+    parser.add_argument('--handle-ms', type=float, default=1, help="优先级测试中每个事件的处理时间(毫秒)")
+    parser.add_argument('--capacity', type=int, default=64, help="溢出测试的队列容量")
+    parser.add_argument('--burst', type=int, default=10000, help="溢出测试的突发事件数")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    with SimulatedWindows():
+        import main as app
+        bench_throughput(app, args.events)
+        bench_priority(app, args.backlog, args.handle_ms)
+        bench_isolation(app, args.backlog, args.handle_ms * 10)
+        bench_overflow(app, args.capacity, args.burst)
+
+
+if __name__ == "__main__":
+    main()
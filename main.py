@@ -4,8 +4,12 @@ import time
 import logging
 import threading
 import json
+import queue
 import ctypes
 import winreg
+import traceback
+import tracemalloc
+from collections import deque
 from datetime import datetime
 from pathlib import Path
 
@@ -62,6 +66,12 @@ class Config:
             'startup_enabled': False,
             'shutdown_enabled': False,
             'notification_method': 'bark',  # 'bark' or 'email'
+            'fallback_methods': [],  # 主推送方式未及时确认时依次尝试的备用方式，如 ['email']
+            'hedge_delay_ms': None,  # 启动下一个推送方式前的等待时间，None 表示使用观测到的 p95 延迟
+            'send_timeout': 10,  # 单次推送的超时时间（秒）
+            'sleep_enabled': False,  # 睡眠/唤醒通知，仅主监听方式（窗口消息）支持
+            'event_queue_size': 64,  # 事件队列容量
+            'event_overflow': 'drop_oldest',  # 队列满时的处理方式: 'drop_newest', 'drop_oldest' or 'coalesce'
             'bark': {
                 'server_url': '',
                 'device_key': ''
@@ -148,10 +158,20 @@ class StartupManager:
 
 # 消息推送
 class Notifier:
+    # 每种推送方式保留的历史延迟样本数，以及计算 p95 所需的最少样本数
+    LATENCY_HISTORY_SIZE = 50
+    MIN_LATENCY_SAMPLES = 5
+    # 样本不足时使用的默认对冲等待时间（毫秒）
+    DEFAULT_HEDGE_DELAY_MS = 3000
+
     def __init__(self, config):
         self.config = config
+        self.latencies = {}
+        self.results = deque(maxlen=100)
+        self.last_result = None
+        self.lock = threading.Lock()
     
-    def send_bark_notification(self, title, content):
+    def send_bark_notification(self, title, content, cancel_event=None):
         try:
             bark_url = self.config['bark']['server_url']
             device_key = self.config['bark']['device_key']
@@ -164,8 +184,13 @@ class Notifier:
             if not bark_url.endswith('/'):
                 bark_url += '/'
             
+            # 其他推送方式已成功，不再发送（返回 None 表示已取消）
+            if cancel_event is not None and cancel_event.is_set():
+                logging.info("Bark消息发送已取消")
+                return None
+            
             url = f"{bark_url}{device_key}/{title}/{content}"
-            response = requests.get(url)
+            response = requests.get(url, timeout=self.config.get('send_timeout', 10))
             
             if response.status_code == 200:
                 logging.info("Bark消息发送成功")
@@ -177,7 +202,7 @@ class Notifier:
             logging.error(f"Bark消息发送异常: {e}")
             return False
     
-    def send_email_notification(self, title, content):
+    def send_email_notification(self, title, content, cancel_event=None):
         try:
             email_config = self.config['email']
             
@@ -191,8 +216,14 @@ class Notifier:
             message['To'] = Header(email_config['receiver'])
             message['Subject'] = Header(title)
             
-            server = smtplib.SMTP_SSL(email_config['smtp_server'], email_config['smtp_port'])
+            server = smtplib.SMTP_SSL(email_config['smtp_server'], email_config['smtp_port'],
+                                      timeout=self.config.get('send_timeout', 10))
             server.login(email_config['sender'], email_config['password'])
+            # 连接和登录期间其他推送方式已成功，不再发送（返回 None 表示已取消）
+            if cancel_event is not None and cancel_event.is_set():
+                server.quit()
+                logging.info("邮件发送已取消")
+                return None
             server.sendmail(email_config['sender'], [email_config['receiver']], message.as_string())
             server.quit()
             
@@ -202,29 +233,470 @@ class Notifier:
             logging.error(f"邮件发送异常: {e}")
             return False
     
-    def send_notification(self, title, content):
-        if self.config['notification_method'] == 'bark':
-            return self.send_bark_notification(title, content)
-        elif self.config['notification_method'] == 'email':
-            return self.send_email_notification(title, content)
+    def _send_by_method(self, method, title, content, cancel_event=None):
+        if method == 'bark':
+            return self.send_bark_notification(title, content, cancel_event)
+        elif method == 'email':
+            return self.send_email_notification(title, content, cancel_event)
         else:
-            logging.error(f"不支持的通知方式: {self.config['notification_method']}")
+            logging.error(f"不支持的通知方式: {method}")
             return False
+    
+    def get_chain(self):
+        # 主推送方式在前，备用方式按配置顺序排在后面，去掉重复项
+        chain = [self.config['notification_method']]
+        for method in self.config.get('fallback_methods', []):
+            if method not in chain:
+                chain.append(method)
+        return chain
+    
+    def get_hedge_delay(self, method):
+        # 返回启动下一个推送方式前等待的秒数
+        hedge_delay_ms = self.config.get('hedge_delay_ms')
+        if hedge_delay_ms is None:
+            hedge_delay_ms = self.get_latency_p95(method) or self.DEFAULT_HEDGE_DELAY_MS
+        return hedge_delay_ms / 1000
+    
+    def get_latency_p95(self, method):
+        # 根据历史成功推送的延迟计算 p95（毫秒），样本不足时返回 None
+        with self.lock:
+            samples = sorted(self.latencies.get(method, []))
+        if len(samples) < self.MIN_LATENCY_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    
+    def send_notification(self, title, content):
+        # 按推送链依次发送：前一个方式失败时立即尝试下一个，
+        # 超过对冲等待时间仍未确认时并行启动下一个，任一方式成功后取消其余方式
+        chain = self.get_chain()
+        start = time.perf_counter()
+        cancel_event = threading.Event()
+        finished = queue.Queue()
+        # 所有已启动的方式都结束后才写入 results / last_result，之后不再修改
+        result = {
+            'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'title': title,
+            'winner': None,
+            'elapsed_ms': None,
+            'hedge_started_ms': None,
+            'runner_up': None,
+            'margin_ms': None,
+            'attempts': []
+        }
+        state = {'running': 0, 'launching': True, 'recorded': False}
+        
+        def elapsed_ms():
+            return round((time.perf_counter() - start) * 1000, 1)
+        
+        def finalize():
+            # 在 self.lock 内调用：仍有方式在发送或还可能启动新方式时不记录
+            if state['recorded'] or state['running'] or state['launching']:
+                return
+            state['recorded'] = True
+            winner = next((a for a in result['attempts'] if a['method'] == result['winner']), None)
+            others = [a for a in result['attempts'] if a is not winner]
+            if winner is not None and others:
+                # 领先时间只与真正送达的方式比较；其余方式失败或被取消时没有可比较的完成时间
+                delivered = [a for a in others if a['status'] == 'success']
+                if delivered:
+                    runner_up = min(delivered, key=lambda a: a['finished_ms'])
+                    result['margin_ms'] = round(runner_up['finished_ms'] - winner['finished_ms'], 1)
+                else:
+                    runner_up = others[0]
+                result['runner_up'] = runner_up['method']
+            self.results.append(result)
+            self.last_result = result
+            if result['margin_ms'] is not None:
+                logging.info(f"推送方式 {result['winner']} 领先 {result['runner_up']} {result['margin_ms']}ms")
+        
+        def attempt_send(attempt):
+            sent = self._send_by_method(attempt['method'], title, content, cancel_event)
+            with self.lock:
+                attempt['finished_ms'] = elapsed_ms()
+                attempt['status'] = 'success' if sent else ('cancelled' if sent is None else 'failed')
+                if sent:
+                    self.latencies.setdefault(attempt['method'], deque(maxlen=self.LATENCY_HISTORY_SIZE)).append(
+                        attempt['finished_ms'] - attempt['started_ms'])
+                    if result['winner'] is None:
+                        result['winner'] = attempt['method']
+                        result['elapsed_ms'] = attempt['finished_ms']
+                        cancel_event.set()
+                state['running'] -= 1
+                finalize()
+            finished.put(attempt)
+        
+        def launch(method, reason):
+            with self.lock:
+                attempt = {'method': method, 'reason': reason, 'started_ms': elapsed_ms(),
+                           'finished_ms': None, 'status': 'pending'}
+                if reason == 'hedge':
+                    result['hedge_started_ms'] = attempt['started_ms']
+                result['attempts'].append(attempt)
+                state['running'] += 1
+            threading.Thread(target=attempt_send, args=(attempt,), daemon=True).start()
+            return attempt
+        
+        next_index = 1
+        pending = 1
+        last_started = launch(chain[0], 'primary')
+        while pending:
+            if next_index < len(chain):
+                wait = self.get_hedge_delay(last_started['method'])
+            else:
+                wait = None
+            try:
+                attempt = finished.get(timeout=wait)
+            except queue.Empty:
+                # 当前方式未在对冲等待时间内确认，并行启动下一个方式
+                logging.warning(f"推送方式 {last_started['method']} 超过 {int(wait * 1000)}ms 未确认，启动 {chain[next_index]}")
+                last_started = launch(chain[next_index], 'hedge')
+                next_index += 1
+                pending += 1
+                continue
+            pending -= 1
+            if attempt['status'] == 'success':
+                break
+            if next_index < len(chain):
+                logging.warning(f"推送方式 {attempt['method']} 失败，改用 {chain[next_index]}")
+                last_started = launch(chain[next_index], 'fallback')
+                next_index += 1
+                pending += 1
+        
+        with self.lock:
+            state['launching'] = False
+            finalize()
+        if result['winner'] is not None:
+            logging.info(f"通知由 {result['winner']} 送达，用时 {result['elapsed_ms']}ms")
+            return True
+        return False
+
+# 事件类型
+class EventType:
+    BOOT = 'boot'
+    SHUTDOWN = 'shutdown'
+    RESTART = 'restart'
+    LOGOFF = 'logoff'
+    SLEEP = 'sleep'
+    RESUME = 'resume'
+    TEST = 'test'
+    
+    # 数字越小优先级越高，关机类事件排在所有事件之前
+    PRIORITIES = {
+        SHUTDOWN: 0,
+        RESTART: 0,
+        LOGOFF: 0,
+        SLEEP: 1,
+        RESUME: 1,
+        BOOT: 2,
+        TEST: 2
+    }
+
+# 系统事件
+class SystemEvent:
+    def __init__(self, event_type, data=None):
+        if event_type not in EventType.PRIORITIES:
+            raise ValueError(f"未知的事件类型: {event_type}")
+        self.type = event_type
+        self.data = data or {}
+        self.priority = EventType.PRIORITIES[event_type]
+        self.time = datetime.now()
+        self.published_at = None
+        self.dropped = False  # 是否被某个订阅者的队列丢弃
+        self.started = threading.Event()  # 所有订阅者都已开始处理（或已丢弃）
+        self.handled = threading.Event()  # 所有订阅者都已处理完成（或已丢弃）
+        self.unstarted = 0
+        self.pending = 0
+        self.lock = threading.Lock()
+    
+    def wait(self, timeout=None):
+        # 等待所有订阅者处理完成（或事件被丢弃）
+        return self.handled.wait(timeout)
+    
+    def _add_delivery(self):
+        with self.lock:
+            self.unstarted += 1
+            self.pending += 1
+    
+    def _mark_started(self):
+        with self.lock:
+            self.unstarted -= 1
+            if self.unstarted == 0:
+                self.started.set()
+    
+    def _mark_finished(self):
+        with self.lock:
+            self.pending -= 1
+            if self.pending == 0:
+                self.handled.set()
+    
+    def _finish_unhandled(self):
+        # 事件在某个订阅者队列中被丢弃或合并，不再单独处理
+        self._mark_started()
+        self._mark_finished()
+
+# 订阅者队列：每个订阅者有自己的有界优先级队列和工作线程，慢订阅者不会拖慢其他订阅者
+class SubscriberQueue:
+    def __init__(self, bus, callback, event_types=None):
+        self.bus = bus
+        self.callback = callback
+        self.event_types = set(event_types) if event_types else None
+        self.name = getattr(callback, '__name__', type(callback).__name__)
+        # 每个优先级一个先进先出队列，元素为 [优先级, 序号, 事件, 合并进来的事件列表]
+        self.queues = {level: deque() for level in set(EventType.PRIORITIES.values())}
+        self.seq = 0
+        self.cond = threading.Condition()
+        self.threads = []
+    
+    def accepts(self, event):
+        return self.event_types is None or event.type in self.event_types
+    
+    def start(self):
+        # 每个优先级一个工作线程，只处理该优先级的事件：关机事件有专用线程，不会排在正在发送的
+        # 低优先级事件后面；同一优先级的事件按发布顺序逐个处理，回调不会并发执行
+        for level in sorted(self.queues):
+            thread = threading.Thread(target=self._work, args=(level,), name=f"EventBus-{self.name}-{level}")
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+    
+    def wake(self):
+        with self.cond:
+            self.cond.notify_all()
+    
+    def clear(self):
+        with self.cond:
+            entries = [entry for entries in self.queues.values() for entry in entries]
+            for entries_of_level in self.queues.values():
+                entries_of_level.clear()
+        for entry in entries:
+            for event in [entry[2]] + entry[3]:
+                event._finish_unhandled()
+    
+    def size(self):
+        with self.cond:
+            return self._size()
+    
+    def _size(self):
+        return sum(len(entries) for entries in self.queues.values())
+    
+    def put(self, event):
+        # 放入队列，返回 'queued'、'coalesced' 或 'dropped'
+        event._add_delivery()
+        with self.cond:
+            status = 'queued'
+            victim = None
+            if self._size() >= self.bus.max_size:
+                status, victim = self._handle_overflow(event)
+            if status == 'queued':
+                self.queues[event.priority].append([event.priority, self.seq, event, []])
+                self.seq += 1
+                self.cond.notify_all()
+        # 在锁外结束被丢弃的事件，避免唤醒等待者时持有队列锁
+        if status != 'queued' or victim is not None:
+            self.bus._record_overflow('coalesced' if status == 'coalesced' else 'dropped')
+        if victim is not None:
+            for dropped in [victim[2]] + victim[3]:
+                dropped.dropped = True
+                dropped._finish_unhandled()
+            logging.warning(f"订阅者 {self.name} 的事件队列已满，丢弃事件: {victim[2].type}")
+        if status == 'dropped':
+            event.dropped = True
+            event._finish_unhandled()
+            logging.warning(f"订阅者 {self.name} 的事件队列已满，丢弃事件: {event.type}")
+        return status
+    
+    def _handle_overflow(self, event):
+        # 队列已满：返回 (处理结果, 被淘汰的队列项)
+        if self.bus.overflow == 'coalesce':
+            for entry in self.queues[event.priority]:
+                if entry[2].type == event.type:
+                    # 合并到已排队的同类事件，处理完已排队事件时一并结束
+                    entry[3].append(event)
+                    return 'coalesced', None
+        
+        # 只淘汰优先级低于（drop_newest）或不高于新事件的事件，保证关机事件不会被低优先级事件挤掉
+        levels = [level for level in self.queues if level > event.priority or
+                  (level == event.priority and self.bus.overflow != 'drop_newest')]
+        candidates = [entry for level in levels for entry in self.queues[level]]
+        if not candidates:
+            return 'dropped', None
+        
+        # 淘汰优先级最低的事件，drop_newest 淘汰其中最新的，其余策略淘汰最早的
+        if self.bus.overflow == 'drop_newest':
+            victim = max(candidates, key=lambda entry: (entry[0], entry[1]))
+        else:
+            victim = max(candidates, key=lambda entry: (entry[0], -entry[1]))
+        self.queues[victim[0]].remove(victim)
+        return 'queued', victim
+    
+    def _work(self, level):
+        entries = self.queues[level]
+        while True:
+            with self.cond:
+                while self.bus.is_running and not entries:
+                    self.cond.wait()
+                if not self.bus.is_running:
+                    return
+                _, _, event, merged = entries.popleft()
+            self.bus._record_queue_latency(event)
+            event._mark_started()
+            for other in merged:
+                other._mark_started()
+            try:
+                self.callback(event)
+            except Exception as e:
+                logging.error(f"事件订阅者 {self.name} 处理 {event.type} 事件失败: {e}")
+            self.bus._record_delivery()
+            event._mark_finished()
+            for other in merged:
+                other._mark_finished()
+
+# 事件总线：把事件分发到各订阅者的队列
+class EventBus:
+    # 队列满时的处理方式：丢弃新事件、丢弃最早的事件、合并同类事件
+    OVERFLOW_POLICIES = ('drop_newest', 'drop_oldest', 'coalesce')
+    
+    def __init__(self, max_size=64, overflow='drop_oldest'):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"不支持的队列溢出策略: {overflow}")
+        self.max_size = max_size  # 每个订阅者队列的容量
+        self.overflow = overflow
+        self.subscribers = []
+        self.is_running = False
+        self.lock = threading.Lock()
+        self.stats = {'published': 0, 'delivered': 0, 'dropped': 0, 'coalesced': 0}
+        self.queue_latencies = deque(maxlen=1000)
+    
+    def subscribe(self, callback, event_types=None):
+        # 订阅事件，event_types 为 None 时接收所有类型
+        subscriber = SubscriberQueue(self, callback, event_types)
+        self.subscribers.append(subscriber)
+        if self.is_running:
+            subscriber.start()
+    
+    def start(self):
+        if not self.is_running:
+            self.is_running = True
+            for subscriber in self.subscribers:
+                subscriber.start()
+            logging.info("事件总线已启动")
+    
+    def stop(self):
+        self.is_running = False
+        for subscriber in self.subscribers:
+            subscriber.wake()
+            # 唤醒仍在等待未处理事件的发布者
+            subscriber.clear()
+        logging.info("事件总线已停止")
+    
+    def publish(self, event):
+        # 发布事件，不会阻塞发布者；所有订阅者都丢弃该事件时返回 None
+        event.published_at = time.perf_counter()
+        with self.lock:
+            self.stats['published'] += 1
+        # 先登记一次投递，保证在所有订阅者入队前事件不会被标记为已处理
+        event._add_delivery()
+        accepted = False
+        for subscriber in self.subscribers:
+            if not subscriber.accepts(event):
+                continue
+            status = subscriber.put(event)
+            accepted = accepted or status != 'dropped'
+        event._finish_unhandled()
+        if not accepted and event.dropped:
+            return None
+        return event
+    
+    def _record_queue_latency(self, event):
+        with self.lock:
+            self.queue_latencies.append(time.perf_counter() - event.published_at)
+    
+    def _record_overflow(self, name):
+        with self.lock:
+            self.stats[name] += 1
+    
+    def _record_delivery(self):
+        with self.lock:
+            self.stats['delivered'] += 1
+    
+    def get_stats(self):
+        # 返回计数和排队延迟（毫秒）
+        with self.lock:
+            stats = dict(self.stats)
+            latencies = sorted(self.queue_latencies)
+        stats['queue_size'] = sum(subscriber.size() for subscriber in self.subscribers)
+        for name, pct in (('queue_p50_ms', 0.5), ('queue_p95_ms', 0.95)):
+            stats[name] = round(latencies[min(len(latencies) - 1, int(len(latencies) * pct))] * 1000, 3) if latencies else None
+        return stats
+
+# 事件订阅者：发送通知
+class NotificationSubscriber:
+    # 事件类型对应的通知名称、内容模板和开关配置项（None 表示总是发送）
+    MESSAGES = {
+        EventType.BOOT: ('开机', "电脑 {computer} 已开机，时间: {time}", 'startup_enabled'),
+        EventType.SHUTDOWN: ('关机', "电脑 {computer} 正在关机，时间: {time}", 'shutdown_enabled'),
+        EventType.RESTART: ('重启', "电脑 {computer} 正在重启，时间: {time}", 'shutdown_enabled'),
+        EventType.LOGOFF: ('注销', "电脑 {computer} 正在注销，时间: {time}", 'shutdown_enabled'),
+        EventType.SLEEP: ('睡眠', "电脑 {computer} 正在进入睡眠，时间: {time}", 'sleep_enabled'),
+        EventType.RESUME: ('唤醒', "电脑 {computer} 已从睡眠中唤醒，时间: {time}", 'sleep_enabled'),
+        EventType.TEST: ('测试', "这是一条测试消息，发送时间: {time}", None)
+    }
+    
+    def __init__(self, notifier, config):
+        self.notifier = notifier
+        self.config = config
+    
+    def format_message(self, event):
+        # 返回通知的标题和内容
+        name, template, _ = self.MESSAGES[event.type]
+        computer_name = os.environ.get('COMPUTERNAME', '未知电脑')
+        title = f"{computer_name} {name}通知"
+        content = template.format(computer=computer_name, time=event.time.strftime('%Y-%m-%d %H:%M:%S'))
+        return title, content
+    
+    def __call__(self, event):
+        name, _, switch = self.MESSAGES[event.type]
+        if switch and not self.config.get(switch, False):
+            return
+        
+        title, content = self.format_message(event)
+        
+        # 尝试发送通知
+        success = self.notifier.send_notification(title, content)
+        event.data['success'] = success
+        if success:
+            logging.info(f"{name}通知发送成功")
+        else:
+            logging.error(f"{name}通知发送失败")
+
+# 事件订阅者：记录事件历史
+class EventHistory:
+    def __init__(self, max_size=100):
+        self.records = deque(maxlen=max_size)
+    
+    def __call__(self, event):
+        self.records.append({
+            'time': event.time.strftime('%Y-%m-%d %H:%M:%S'),
+            'type': event.type,
+            'dropped': event.dropped
+        })
 
 # 关机监听
 class ShutdownListener:
     # 类变量，用于跟踪窗口类是否已注册
     class_registered = False
     hwnd = None
+    # 等待事件开始处理的最长时间（秒）
+    QUEUE_WAIT_TIMEOUT = 5
     
-    def __init__(self, notifier, config):
-        self.notifier = notifier
+    def __init__(self, event_bus, config):
+        self.event_bus = event_bus
         self.config = config
         self.is_running = False
         self.thread = None
     
     def start(self):
-        if not self.is_running and self.config['shutdown_enabled']:
+        if not self.is_running and (self.config['shutdown_enabled'] or self.config.get('sleep_enabled', False)):
             self.is_running = True
             self.thread = threading.Thread(target=self._listen_for_shutdown)
             self.thread.daemon = True
@@ -245,14 +717,27 @@ class ShutdownListener:
             def handle_system_command(hwnd, msg, wparam, lparam):
                 if msg == win32con.WM_QUERYENDSESSION:
                     logging.info(f"检测到系统关机事件，消息ID: {msg}")
-                    # 根据wParam判断是否为重启事件
-                    is_restart = (wparam & 0x00000040) == 0x00000040
-                    self._send_shutdown_notification(is_restart=is_restart)
+                    # 根据wParam判断是否为重启事件，根据lParam判断是否为注销事件
+                    if (wparam & 0x00000040) == 0x00000040:
+                        self._publish_event(EventType.RESTART)
+                    elif lparam & 0x80000000:  # ENDSESSION_LOGOFF
+                        self._publish_event(EventType.LOGOFF)
+                    else:
+                        self._publish_event(EventType.SHUTDOWN)
                     return 0
                 elif msg == win32con.WM_ENDSESSION:
                     # 忽略WM_ENDSESSION消息，避免重复通知
                     logging.info(f"收到WM_ENDSESSION消息，已忽略，消息ID: {msg}")
                     return 0
+                elif msg == win32con.WM_POWERBROADCAST:
+                    # 睡眠前同步等待通知发出，唤醒后不阻塞消息循环
+                    if wparam == 0x0004:  # PBT_APMSUSPEND
+                        logging.info("检测到系统睡眠事件")
+                        self._publish_event(EventType.SLEEP)
+                    elif wparam == 0x0012:  # PBT_APMRESUMEAUTOMATIC
+                        logging.info("检测到系统唤醒事件")
+                        self._publish_event(EventType.RESUME, wait=False)
+                    return 1
                 elif msg == win32con.WM_SYSCOMMAND:
                     if wparam == win32con.SC_CLOSE:
                         logging.info("检测到窗口关闭事件")
@@ -303,10 +788,18 @@ class ShutdownListener:
             
             watcher = c.Win32_ComputerShutdownEvent.watch_for()
             while self.is_running:
-                shutdown_event = watcher(timeout_ms=100)
+                try:
+                    shutdown_event = watcher(timeout_ms=100)
+                except wmi.x_wmi_timed_out:
+                    # 超时表示没有事件，继续等待
+                    continue
                 if shutdown_event:
                     logging.info("检测到系统关机事件(WMI)")
-                    self._send_shutdown_notification()
+                    # Type 为 0 表示注销，1 表示关机
+                    if getattr(shutdown_event, 'Type', 1) == 0:
+                        self._publish_event(EventType.LOGOFF)
+                    else:
+                        self._publish_event(EventType.SHUTDOWN)
                 time.sleep(0.1)
         except ImportError:
             logging.error("无法导入wmi模块，使用最后备用方法监听关机事件")
@@ -330,7 +823,10 @@ class ShutdownListener:
             def handle_shutdown(ctrl_type):
                 if ctrl_type in (win32con.CTRL_SHUTDOWN_EVENT, win32con.CTRL_LOGOFF_EVENT):
                     logging.info(f"检测到系统事件: {ctrl_type}")
-                    self._send_shutdown_notification()
+                    if ctrl_type == win32con.CTRL_LOGOFF_EVENT:
+                        self._publish_event(EventType.LOGOFF)
+                    else:
+                        self._publish_event(EventType.SHUTDOWN)
                     return True
                 return False
             
@@ -343,18 +839,193 @@ class ShutdownListener:
         except Exception as e:
             logging.error(f"设置关机监听失败: {e}")
     
-    def _send_shutdown_notification(self, is_restart=False):
-        if self.config['shutdown_enabled']:
-            computer_name = os.environ.get('COMPUTERNAME', '未知电脑')
-            title = f"{computer_name} {'重启' if is_restart else '关机'}通知"
-            content = f"电脑 {computer_name} 正在{'重启' if is_restart else '关机'}，时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-            
-            # 尝试发送通知
-            success = self.notifier.send_notification(title, content)
-            if success:
-                logging.info("关机通知发送成功")
-            else:
-                logging.error("关机通知发送失败")
+    def _publish_event(self, event_type, wait=True):
+        # 发布事件并等待处理完成，使系统在通知发出后再继续关机/睡眠；
+        # 排队等待和发送分别计时，排队时间不占用发送的超时时间
+        event = self.event_bus.publish(SystemEvent(event_type))
+        if event is None or not wait:
+            return
+        if not event.started.wait(self.QUEUE_WAIT_TIMEOUT):
+            logging.warning(f"{event_type} 事件等待处理超时")
+            return
+        chain_length = 1 + len(self.config.get('fallback_methods', []))
+        if not event.wait(self.config.get('send_timeout', 10) * chain_length):
+            logging.warning(f"{event_type} 事件处理超时")
+
+# 性能分析：CPU 采样、内存快照和线程堆栈导出，未开启时不产生任何开销
+class Profiler:
+    # CPU 采样间隔（秒）、tracemalloc 保存的堆栈深度和内存折叠堆栈文件中保留的调用位置数
+    SAMPLE_INTERVAL = 0.01
+    TRACEMALLOC_FRAMES = 25
+    MEMORY_FOLDED_LIMIT = 1000
+    
+    def __init__(self, log_dir):
+        self.log_dir = Path(log_dir)
+        self.sampling = False
+        self.sample_thread = None
+        self.samples = {}  # 折叠堆栈 -> CPU 时间（微秒）
+        self.sample_count = 0
+        self.memory_baseline = None
+        self.memory_previous = None
+        self.lock = threading.Lock()
+        # 输出文件序号，保证同一毫秒内连续写出的文件也不会互相覆盖
+        self.output_count = 0
+        self.output_lock = threading.Lock()
+    
+    @property
+    def tracing_memory(self):
+        return tracemalloc.is_tracing()
+    
+    def _output_path(self, prefix, suffix):
+        self.log_dir.mkdir(exist_ok=True)
+        with self.output_lock:
+            self.output_count += 1
+            count = self.output_count
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')[:-3]
+        return self.log_dir / f"{prefix}_{timestamp}_{count}{suffix}"
+    
+    def apply_env(self, value):
+        # 根据环境变量开启分析，如 PC_NOTIFIER_PROFILE=cpu,memory 或 PC_NOTIFIER_PROFILE=all
+        options = {item.strip().lower() for item in value.split(',') if item.strip()}
+        if options & {'1', 'all', 'cpu'}:
+            self.start_cpu_profile()
+        if options & {'1', 'all', 'memory'}:
+            self.start_memory_trace()
+    
+    def start_cpu_profile(self):
+        with self.lock:
+            if self.sampling:
+                return
+            self.sampling = True
+            self.samples = {}
+            self.sample_count = 0
+        self.sample_thread = threading.Thread(target=self._sample_loop, name="ProfilerSampler")
+        self.sample_thread.daemon = True
+        self.sample_thread.start()
+        logging.info("CPU采样已开启")
+    
+    def stop_cpu_profile(self):
+        # 停止采样并写出折叠堆栈文件，权重为 CPU 时间（微秒），可用 speedscope、flamegraph.pl 等工具查看
+        with self.lock:
+            if not self.sampling:
+                return None
+            self.sampling = False
+        self.sample_thread.join()
+        
+        path = self._output_path('cpu_profile', '.folded')
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write(f"{stack} {count}\n")
+        cpu_ms = sum(self.samples.values()) / 1000
+        logging.info(f"CPU采样已停止，共 {self.sample_count} 次采样，记录 CPU 时间 {cpu_ms:.1f}ms，结果已保存: {path}")
+        return path
+    
+    def _sample_loop(self):
+        # 每次采样时，把各线程自上次采样以来消耗的 CPU 时间记到该线程当前的堆栈上；
+        # CPU 时间没有增加的线程（在 sleep、wait 或消息循环中等待）不计入
+        import psutil
+        process = psutil.Process()
+        own_id = threading.get_ident()
+        cpu_times = {}
+        while self.sampling:
+            threads = {thread.ident: thread for thread in threading.enumerate()}
+            try:
+                current = {item.id: item.user_time + item.system_time for item in process.threads()}
+            except psutil.Error as e:
+                logging.error(f"读取线程CPU时间失败: {e}")
+                current = {}
+            for thread_id, frame in sys._current_frames().items():
+                thread = threads.get(thread_id)
+                if thread_id == own_id or thread is None or thread.native_id not in current:
+                    continue
+                previous = cpu_times.get(thread.native_id)
+                cpu_times[thread.native_id] = current[thread.native_id]
+                weight = 0 if previous is None else round((current[thread.native_id] - previous) * 1000000)
+                if weight <= 0:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(thread.name)
+                key = ';'.join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + weight
+            self.sample_count += 1
+            time.sleep(self.SAMPLE_INTERVAL)
+    
+    def start_memory_trace(self):
+        if tracemalloc.is_tracing():
+            return
+        tracemalloc.start(self.TRACEMALLOC_FRAMES)
+        self.memory_baseline = self._take_snapshot()
+        self.memory_previous = self.memory_baseline
+        logging.info("内存跟踪已开启")
+    
+    def stop_memory_trace(self):
+        if not tracemalloc.is_tracing():
+            return
+        self.take_memory_snapshot()
+        tracemalloc.stop()
+        self.memory_baseline = None
+        self.memory_previous = None
+        logging.info("内存跟踪已停止")
+    
+    def _take_snapshot(self):
+        # 排除 tracemalloc 自身和导入机制的内存分配
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+    
+    def take_memory_snapshot(self, limit=30):
+        # 保存快照（可用 tracemalloc.Snapshot.load 读取），写出按调用堆栈汇总的折叠堆栈文件
+        # （权重为字节数，可用 speedscope、flamegraph.pl 等工具查看），以及与开启时和上一次快照的对比
+        if not tracemalloc.is_tracing():
+            logging.error("内存跟踪未开启，无法保存快照")
+            return None
+        snapshot = self._take_snapshot()
+        path = self._output_path('memory_snapshot', '.tracemalloc')
+        snapshot.dump(str(path))
+        
+        folded_path = path.with_suffix('.folded')
+        with open(folded_path, 'w', encoding='utf-8') as f:
+            for stat in snapshot.statistics('traceback')[:self.MEMORY_FOLDED_LIMIT]:
+                # 帧按从最早到最近的顺序排列，与折叠堆栈从根到叶的顺序一致
+                stack = ';'.join(f"{os.path.basename(frame.filename)}:{frame.lineno}" for frame in stat.traceback)
+                f.write(f"{stack} {stat.size}\n")
+        
+        diff_path = path.with_suffix('.diff.txt')
+        current, peak = tracemalloc.get_traced_memory()
+        with open(diff_path, 'w', encoding='utf-8') as f:
+            f.write(f"当前内存: {current / 1024:.1f} KiB, 峰值: {peak / 1024:.1f} KiB\n")
+            for name, base in (('开启跟踪以来', self.memory_baseline), ('上一次快照以来', self.memory_previous)):
+                f.write(f"\n== {name}增长最多的 {limit} 处 ==\n")
+                for stat in snapshot.compare_to(base, 'lineno')[:limit]:
+                    f.write(f"{stat}\n")
+        self.memory_previous = snapshot
+        logging.info(f"内存快照已保存: {path}")
+        return path
+    
+    def dump_thread_stacks(self):
+        # 导出所有线程当前的调用堆栈
+        path = self._output_path('thread_stacks', '.txt')
+        names = {thread.ident: thread for thread in threading.enumerate()}
+        with open(path, 'w', encoding='utf-8') as f:
+            for thread_id, frame in sys._current_frames().items():
+                thread = names.get(thread_id)
+                name = thread.name if thread else f"Thread-{thread_id}"
+                daemon = ' (daemon)' if thread and thread.daemon else ''
+                f.write(f"Thread {name} [{thread_id}]{daemon}:\n")
+                f.write(''.join(traceback.format_stack(frame)))
+                f.write('\n')
+        logging.info(f"线程堆栈已导出: {path}")
+        return path
+    
+    def stop_all(self):
+        self.stop_cpu_profile()
+        self.stop_memory_trace()
 
 # GUI界面
 class NotifierApp:
@@ -370,14 +1041,25 @@ class NotifierApp:
         self.config_manager = Config()
         self.config = self.config_manager.config
         
+        # 初始化性能分析，可通过环境变量 PC_NOTIFIER_PROFILE 在启动时开启
+        self.profiler = Profiler(Path(get_app_dir()) / 'logs')
+        self.profiler.apply_env(os.environ.get('PC_NOTIFIER_PROFILE', ''))
+        
         # 初始化启动项管理器
         self.startup_manager = StartupManager()
         
         # 初始化通知器
         self.notifier = Notifier(self.config)
         
+        # 初始化事件总线，通知发送和事件历史记录各自订阅
+        self.event_bus = EventBus(self.config.get('event_queue_size', 64), self.config.get('event_overflow', 'drop_oldest'))
+        self.event_history = EventHistory()
+        self.event_bus.subscribe(NotificationSubscriber(self.notifier, self.config))
+        self.event_bus.subscribe(self.event_history)
+        self.event_bus.start()
+        
         # 初始化关机监听器
-        self.shutdown_listener = ShutdownListener(self.notifier, self.config)
+        self.shutdown_listener = ShutdownListener(self.event_bus, self.config)
         
         # 检查是否是开机启动
         self.is_startup_launch = self._check_startup_launch()
@@ -402,12 +1084,12 @@ class NotifierApp:
         
         # 如果是开机启动，则直接最小化到托盘
         if self.is_startup_launch and self.config['startup_enabled']:
-            self._send_startup_notification()
+            self.event_bus.publish(SystemEvent(EventType.BOOT))
             self.root.withdraw()
             self._create_tray_icon()
         
-        # 启动关机监听
-        if self.config['shutdown_enabled']:
+        # 启动关机（及睡眠/唤醒）监听
+        if self.config['shutdown_enabled'] or self.config.get('sleep_enabled', False):
             self.shutdown_listener.start()
     
     def _ensure_single_instance(self):
@@ -514,12 +1196,20 @@ class NotifierApp:
         self.shutdown_var = tk.BooleanVar(value=self.config['shutdown_enabled'])
         ttk.Checkbutton(frame, text="启用关机通知", variable=self.shutdown_var).grid(row=1, column=0, sticky=tk.W, pady=5)
         
+        # 睡眠/唤醒通知设置
+        self.sleep_var = tk.BooleanVar(value=self.config.get('sleep_enabled', False))
+        ttk.Checkbutton(frame, text="启用睡眠/唤醒通知", variable=self.sleep_var).grid(row=1, column=1, sticky=tk.W, padx=10, pady=5)
+        
         # 推送方式选择
         ttk.Label(frame, text="推送方式:").grid(row=2, column=0, sticky=tk.W, pady=10)
         
         self.notification_method_var = tk.StringVar(value=self.config['notification_method'])
         ttk.Radiobutton(frame, text="Bark", variable=self.notification_method_var, value="bark").grid(row=3, column=0, sticky=tk.W)
         ttk.Radiobutton(frame, text="邮件", variable=self.notification_method_var, value="email").grid(row=4, column=0, sticky=tk.W)
+        
+        # 备用推送方式：主方式失败或未及时确认时使用另一种方式
+        self.fallback_var = tk.BooleanVar(value=bool(self.config.get('fallback_methods')))
+        ttk.Checkbutton(frame, text="主推送方式失败或超时时使用另一种方式", variable=self.fallback_var).grid(row=5, column=0, columnspan=2, sticky=tk.W, pady=5)
     
     def _create_bark_settings(self, parent):
         # Bark设置界面
@@ -574,7 +1264,14 @@ class NotifierApp:
         # 创建托盘图标
         if self.tray_icon is None:
             icon = Image.open(self.icon_path)
+            profile_menu = pystray.Menu(
+                pystray.MenuItem('CPU采样', self._toggle_cpu_profile, checked=lambda item: self.profiler.sampling),
+                pystray.MenuItem('内存跟踪', self._toggle_memory_trace, checked=lambda item: self.profiler.tracing_memory),
+                pystray.MenuItem('保存内存快照', self._take_memory_snapshot, enabled=lambda item: self.profiler.tracing_memory),
+                pystray.MenuItem('导出线程堆栈', self._dump_thread_stacks))
             menu = (pystray.MenuItem('显示', self._show_window),
+                    pystray.MenuItem('记录事件统计', self._log_event_stats),
+                    pystray.MenuItem('性能分析', profile_menu),
                     pystray.MenuItem('退出', self._quit_app))
             self.tray_icon = pystray.Icon("PC_Notifier", icon, "电脑开关机通知", menu)
             self.tray_icon.on_double_click = self._show_window  # 添加双击事件处理
@@ -588,6 +1285,34 @@ class NotifierApp:
         self.root.focus_force()
         logging.info("显示主窗口")
     
+    def _log_event_stats(self, icon=None, item=None):
+        # 把事件总线的统计和最近的事件历史写入日志
+        logging.info(f"事件总线统计: {self.event_bus.get_stats()}")
+        for record in list(self.event_history.records):
+            logging.info(f"事件记录: {record['time']} {record['type']}{'（已被丢弃）' if record['dropped'] else ''}")
+    
+    def _toggle_cpu_profile(self, icon=None, item=None):
+        # 开启/停止CPU采样
+        if self.profiler.sampling:
+            self.profiler.stop_cpu_profile()
+        else:
+            self.profiler.start_cpu_profile()
+    
+    def _toggle_memory_trace(self, icon=None, item=None):
+        # 开启/停止内存跟踪
+        if self.profiler.tracing_memory:
+            self.profiler.stop_memory_trace()
+        else:
+            self.profiler.start_memory_trace()
+    
+    def _take_memory_snapshot(self, icon=None, item=None):
+        # 保存内存快照
+        self.profiler.take_memory_snapshot()
+    
+    def _dump_thread_stacks(self, icon=None, item=None):
+        # 导出线程堆栈
+        self.profiler.dump_thread_stacks()
+    
     def _minimize_to_tray(self):
         # 最小化到托盘
         self.root.withdraw()
@@ -605,6 +1330,11 @@ class NotifierApp:
         
         # 停止关机监听
         self.shutdown_listener.stop()
+        self._log_event_stats()
+        self.event_bus.stop()
+        
+        # 保存未停止的性能分析结果
+        self.profiler.stop_all()
         
         logging.info("程序退出")
         # 使用after方法确保在主线程中执行销毁操作
@@ -632,7 +1362,9 @@ class NotifierApp:
         # 更新配置
         self.config['startup_enabled'] = self.startup_var.get()
         self.config['shutdown_enabled'] = self.shutdown_var.get()
+        self.config['sleep_enabled'] = self.sleep_var.get()
         self.config['notification_method'] = self.notification_method_var.get()
+        self.config['fallback_methods'] = self._get_fallback_methods()
         
         # 更新Bark设置
         self.config['bark']['server_url'] = self.bark_server_var.get()
@@ -655,8 +1387,8 @@ class NotifierApp:
             else:
                 self.startup_manager.remove_from_startup()
             
-            # 更新关机监听状态
-            if self.config['shutdown_enabled']:
+            # 更新关机（及睡眠/唤醒）监听状态
+            if self.config['shutdown_enabled'] or self.config['sleep_enabled']:
                 self.shutdown_listener.start()
             else:
                 self.shutdown_listener.stop()
@@ -665,15 +1397,16 @@ class NotifierApp:
         else:
             messagebox.showerror("保存失败", "配置保存失败")
     
+    def _get_fallback_methods(self):
+        # 根据界面选择生成备用推送方式列表
+        if not self.fallback_var.get():
+            return []
+        return ['email' if self.notification_method_var.get() == 'bark' else 'bark']
+    
     def _test_notification(self):
         # 测试推送
-        computer_name = os.environ.get('COMPUTERNAME', '未知电脑')
-        title = f"{computer_name} 测试通知"
-        content = f"这是一条测试消息，发送时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-        
         # 临时使用当前界面的配置进行测试
         test_config = self.config.copy()
-        test_config['notification_method'] = self.notification_method_var.get()
         
         # 更新Bark设置
         test_config['bark']['server_url'] = self.bark_server_var.get()
@@ -686,32 +1419,35 @@ class NotifierApp:
         test_config['email']['password'] = self.password_var.get()
         test_config['email']['receiver'] = self.receiver_var.get()
         
-        # 创建临时通知器
-        test_notifier = Notifier(test_config)
-        
-        # 发送测试通知
-        success = test_notifier.send_notification(title, content)
+        # 推送链中的每种方式单独测试，备用方式不能掩盖主方式的配置错误
+        method_names = {'bark': 'Bark', 'email': '邮件'}
+        chain = [self.notification_method_var.get()] + self._get_fallback_methods()
+        lines = []
+        success = True
+        for method in chain:
+            method_config = dict(test_config, notification_method=method, fallback_methods=[])
+            
+            # 创建临时通知器，在当前线程中直接处理测试事件以便显示结果
+            test_notifier = Notifier(method_config)
+            event = SystemEvent(EventType.TEST)
+            NotificationSubscriber(test_notifier, method_config)(event)
+            self.event_history(event)
+            
+            result = test_notifier.last_result
+            name = method_names.get(method, method)
+            if event.data['success'] and result and result['winner'] == method:
+                lines.append(f"{name}: 发送成功，用时 {result['elapsed_ms']}ms")
+            else:
+                lines.append(f"{name}: 发送失败")
+                success = False
         
+        summary = '\n'.join(lines)
         if success:
-            messagebox.showinfo("测试成功", "测试消息发送成功")
-            logging.info("测试消息发送成功")
+            messagebox.showinfo("测试成功", f"测试消息发送成功\n{summary}")
+            logging.info(f"测试消息发送成功: {summary}")
         else:
-            messagebox.showerror("测试失败", "测试消息发送失败，请检查配置")
-            logging.error("测试消息发送失败")
-    
-    def _send_startup_notification(self):
-        # 发送开机通知
-        if self.config['startup_enabled']:
-            computer_name = os.environ.get('COMPUTERNAME', '未知电脑')
-            title = f"{computer_name} 开机通知"
-            content = f"电脑 {computer_name} 已开机，时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-            
-            # 尝试发送通知
-            success = self.notifier.send_notification(title, content)
-            if success:
-                logging.info("开机通知发送成功")
-            else:
-                logging.error("开机通知发送失败")
+            messagebox.showerror("测试失败", f"测试消息发送失败，请检查配置\n{summary}")
+            logging.error(f"测试消息发送失败: {summary}")
     
     def run(self):
         # 运行应用
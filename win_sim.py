@@ -0,0 +1,729 @@
+"""Windows 消息路径模拟器
+
+在非 Windows 环境（如 Linux CI）下为 win32api / win32con / win32gui / wmi /
+winreg 以及控制台控制处理函数(SetConsoleCtrlHandler)提供假实现，
+把脚本化的系统事件高速回放给 ShutdownListener 的三种监听策略，
+并在本地传输替身(Bark HTTP / SMTP)上记录每个事件从注入到第一个字节
+到达"网络"的延迟。
+
+用法:
+    python win_sim.py --repeat 20 --trace
+    python win_sim.py --interval 0 --repeat 5
+    python win_sim.py --hedge
+"""
+import os
+import re
+import sys
+import time
+import json
+import types
+import queue
+import ctypes
+import logging
+import argparse
+import threading
+import socketserver
+from email import message_from_bytes
+from email.header import decode_header, make_header
+from datetime import datetime
+from pathlib import Path
+
+# 脚本化事件
+QUERY_END_SESSION = 'query_end_session'
+QUERY_RESTART = 'query_restart'
+END_SESSION = 'end_session'
+CANCEL_SESSION = 'cancel_session'
+SUSPEND = 'suspend'
+RESUME = 'resume'
+
+# 预置场景：正常关机、重启、取消关机、重复消息、睡眠/唤醒（仅窗口消息方式支持）、混合消息连发
+SCENARIOS = {
+    'shutdown': [QUERY_END_SESSION, END_SESSION],
+    'restart': [QUERY_RESTART, END_SESSION],
+    'cancelled': [QUERY_END_SESSION, CANCEL_SESSION],
+    'duplicate': [QUERY_END_SESSION, QUERY_END_SESSION, END_SESSION, END_SESSION],
+    'sleep': [SUSPEND, RESUME],
+    'burst': [QUERY_END_SESSION, CANCEL_SESSION, QUERY_RESTART, CANCEL_SESSION, SUSPEND, RESUME, QUERY_END_SESSION, END_SESSION],
+}
+
+# 应当发出通知的事件；其余事件不等待发送，只在场景结束时检查是否有意外的发送
+SENDING_EVENTS = (QUERY_END_SESSION, QUERY_RESTART, SUSPEND, RESUME)
+
+# 通知标题中的步骤标记：simtag<场景运行序号>x<步骤序号>
+TAG_PATTERN = re.compile(r'simtag(\d+)x(\d+)')
+
+# 假实现把消息交给监听方时，在回调线程中记录该消息所属的场景步骤，
+# 监听方在同一线程中发布事件，发布时据此给事件打上步骤标记
+DISPATCH = threading.local()
+
+
+def current_step():
+    return getattr(DISPATCH, 'step', None)
+
+
+# 三种监听策略对应的 ShutdownListener 方法
+STRATEGIES = {
+    'wndproc': '_listen_for_shutdown',
+    'wmi': '_fallback_shutdown_listener',
+    'console': '_last_resort_shutdown_listener',
+}
+
+# Windows 常量（与 win32con 中的取值一致）
+WM_QUERYENDSESSION = 0x0011
+WM_ENDSESSION = 0x0016
+WM_SYSCOMMAND = 0x0112
+WM_POWERBROADCAST = 0x0218
+PBT_APMSUSPEND = 0x0004
+PBT_APMRESUMEAUTOMATIC = 0x0012
+SC_CLOSE = 0xF060
+CTRL_LOGOFF_EVENT = 5
+CTRL_SHUTDOWN_EVENT = 6
+RESTART_FLAG = 0x00000040
+
+
+class FakeWin32Gui:
+    # 模拟窗口类注册、窗口创建和消息泵
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.classes = {}
+        self.windows = {}
+        self.messages = queue.Queue()
+        self.next_hwnd = 0x1000
+
+    def make_module(self):
+        module = types.ModuleType('win32gui')
+        module.WNDCLASS = lambda: types.SimpleNamespace(lpfnWndProc=None, lpszClassName='', hInstance=None)
+        module.RegisterClass = self.RegisterClass
+        module.CreateWindow = self.CreateWindow
+        module.IsWindow = lambda hwnd: hwnd in self.windows
+        module.PumpWaitingMessages = self.PumpWaitingMessages
+        module.DefWindowProc = lambda hwnd, msg, wparam, lparam: 0
+        return module
+
+    def RegisterClass(self, wc):
+        if wc.lpszClassName in self.classes:
+            raise Exception("类已存在")
+        self.classes[wc.lpszClassName] = wc.lpfnWndProc
+        return len(self.classes)
+
+    def CreateWindow(self, class_name, *args):
+        self.next_hwnd += 1
+        self.windows[self.next_hwnd] = self.classes[class_name]
+        return self.next_hwnd
+
+    def PumpWaitingMessages(self):
+        # 与真实实现一样，在调用线程中把队列里的消息分发给窗口过程
+        while True:
+            try:
+                msg, wparam, lparam, step = self.messages.get_nowait()
+            except queue.Empty:
+                return 0
+            DISPATCH.step = step
+            for hwnd, wndproc in list(self.windows.items()):
+                wndproc(hwnd, msg, wparam, lparam)
+
+    def deliver(self, event, step=None):
+        messages = {
+            QUERY_END_SESSION: (WM_QUERYENDSESSION, 0, 0),
+            QUERY_RESTART: (WM_QUERYENDSESSION, RESTART_FLAG, 0),
+            END_SESSION: (WM_ENDSESSION, 1, 0),
+            CANCEL_SESSION: (WM_ENDSESSION, 0, 0),
+            SUSPEND: (WM_POWERBROADCAST, PBT_APMSUSPEND, 0),
+            RESUME: (WM_POWERBROADCAST, PBT_APMRESUMEAUTOMATIC, 0),
+        }
+        if event not in messages:
+            return False
+        self.messages.put(messages[event] + (step,))
+        return True
+
+
+class FakeWMI:
+    # 模拟 wmi.WMI().Win32_ComputerShutdownEvent.watch_for()
+    def __init__(self):
+        self.events = queue.Queue()
+        self.module = types.ModuleType('wmi')
+        self.module.x_wmi_timed_out = type('x_wmi_timed_out', (Exception,), {})
+        self.module.WMI = lambda: types.SimpleNamespace(
+            Win32_ComputerShutdownEvent=types.SimpleNamespace(watch_for=self.watch_for)
+        )
+
+    def reset(self):
+        self.events = queue.Queue()
+
+    def watch_for(self):
+        def watcher(timeout_ms=None):
+            try:
+                event, DISPATCH.step = self.events.get(timeout=None if timeout_ms is None else timeout_ms / 1000)
+                return event
+            except queue.Empty:
+                # 真实的 wmi 在超时时抛出 x_wmi_timed_out
+                raise self.module.x_wmi_timed_out()
+        return watcher
+
+    def deliver(self, event, step=None):
+        # WMI 只有一个关机事件，不区分 QUERY/END 和重启
+        if event in (QUERY_END_SESSION, QUERY_RESTART):
+            self.events.put((types.SimpleNamespace(Type=1), step))
+            return True
+        return False
+
+
+class FakeConsole:
+    # 模拟 kernel32.SetConsoleCtrlHandler，事件在独立线程中回调（与 Windows 一致）
+    def __init__(self):
+        self.handlers = []
+        fake = self
+
+        class SetConsoleCtrlHandler:
+            argtypes = None
+            restype = None
+
+            def __call__(self, handler, add):
+                if add:
+                    fake.handlers.append(handler)
+                elif handler in fake.handlers:
+                    fake.handlers.remove(handler)
+                return 1
+
+        self.kernel32 = types.SimpleNamespace(
+            SetConsoleCtrlHandler=SetConsoleCtrlHandler(),
+            CreateMutexW=lambda *args: 1,
+            GetLastError=lambda: 0,
+        )
+
+    def reset(self):
+        self.handlers = []
+
+    def deliver(self, event, step=None):
+        if event not in (QUERY_END_SESSION, QUERY_RESTART):
+            return False
+
+        def dispatch():
+            DISPATCH.step = step
+            for handler in reversed(list(self.handlers)):
+                if handler(CTRL_SHUTDOWN_EVENT):
+                    break
+        threading.Thread(target=dispatch, daemon=True).start()
+        return True
+
+
+def _make_win32con():
+    module = types.ModuleType('win32con')
+    module.WM_QUERYENDSESSION = WM_QUERYENDSESSION
+    module.WM_ENDSESSION = WM_ENDSESSION
+    module.WM_SYSCOMMAND = WM_SYSCOMMAND
+    module.WM_POWERBROADCAST = WM_POWERBROADCAST
+    module.SC_CLOSE = SC_CLOSE
+    module.CTRL_LOGOFF_EVENT = CTRL_LOGOFF_EVENT
+    module.CTRL_SHUTDOWN_EVENT = CTRL_SHUTDOWN_EVENT
+    return module
+
+
+def _make_win32api():
+    module = types.ModuleType('win32api')
+    module.GetModuleHandle = lambda name: 0x400000
+    return module
+
+
+def _make_winreg():
+    # 仅用于让 main.py 在非 Windows 环境下可以导入，注册表存放在内存中
+    module = types.ModuleType('winreg')
+    store = {}
+    module.HKEY_CURRENT_USER = 'HKCU'
+    module.KEY_SET_VALUE = 2
+    module.KEY_READ = 1
+    module.REG_SZ = 1
+    module.OpenKey = lambda root, path, reserved=0, access=0: store.setdefault((root, path), {})
+    module.CloseKey = lambda key: None
+    module.SetValueEx = lambda key, name, reserved, kind, value: key.__setitem__(name, value)
+    module.DeleteValue = lambda key, name: key.pop(name)
+
+    def QueryValueEx(key, name):
+        if name not in key:
+            raise FileNotFoundError(name)
+        return key[name], module.REG_SZ
+    module.QueryValueEx = QueryValueEx
+    return module
+
+
+class SimulatedWindows:
+    # 安装/卸载假的 Windows 模块，作为上下文管理器使用
+    def __init__(self):
+        self.gui = FakeWin32Gui()
+        self.wmi = FakeWMI()
+        self.console = FakeConsole()
+        self.modules = {
+            'win32api': _make_win32api(),
+            'win32con': _make_win32con(),
+            'win32gui': self.gui.make_module(),
+            'wmi': self.wmi.module,
+            'winreg': _make_winreg(),
+        }
+        self.saved_modules = {}
+        self.saved_ctypes = {}
+
+    def __enter__(self):
+        for name, module in self.modules.items():
+            self.saved_modules[name] = sys.modules.get(name)
+            sys.modules[name] = module
+        for name, value in (('windll', types.SimpleNamespace(kernel32=self.console.kernel32)),
+                            ('WINFUNCTYPE', ctypes.CFUNCTYPE)):
+            self.saved_ctypes[name] = getattr(ctypes, name, None)
+            setattr(ctypes, name, value)
+        # 没有图形界面时让 pystray 使用 dummy 后端
+        os.environ.setdefault('PYSTRAY_BACKEND', 'dummy')
+        return self
+
+    def __exit__(self, *exc):
+        for name, module in self.saved_modules.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+        for name, value in self.saved_ctypes.items():
+            if value is None:
+                delattr(ctypes, name)
+            else:
+                setattr(ctypes, name, value)
+        return False
+
+    def reset(self):
+        self.gui.reset()
+        self.wmi.reset()
+        self.console.reset()
+
+    def deliver(self, strategy, event, step=None):
+        fake = {'wndproc': self.gui, 'wmi': self.wmi, 'console': self.console}[strategy]
+        return fake.deliver(event, step)
+
+
+class TransportStandIn(socketserver.ThreadingTCPServer):
+    # 本地传输替身：按通知标题中的步骤标记，记录每条消息的连接上客户端第一个字节到达的时间
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handler_class, delay=0):
+        super().__init__(('127.0.0.1', 0), handler_class)
+        self.delay = delay  # 应答前的延迟（秒），模拟慢但没有宕机的服务
+        self.delivered = 0  # 完整送达的消息数
+        self.arrivals = {}  # 步骤标记 -> 第一个字节到达时间列表
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def record_arrival(self, text, first_byte_at):
+        # 从请求路径或邮件主题中取出步骤标记
+        match = TAG_PATTERN.search(text)
+        tag = match.group(0) if match else None
+        with self.cond:
+            self.arrivals.setdefault(tag, []).append(first_byte_at)
+            self.cond.notify_all()
+
+    def get_arrivals(self, tag):
+        with self.cond:
+            return list(self.arrivals.get(tag, []))
+
+    def record_delivery(self):
+        with self.cond:
+            self.delivered += 1
+
+    def wait_for_tag(self, tag, timeout):
+        # 等待带有该标记的消息到达，超时直接返回
+        deadline = time.perf_counter() + timeout
+        with self.cond:
+            while not self.arrivals.get(tag):
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return
+                self.cond.wait(remaining)
+
+
+class BarkHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        first = self.rfile.read(1)
+        if not first:
+            return
+        first_byte_at = time.perf_counter()
+        # 请求行中包含标题（及其中的步骤标记），读完请求头后返回 200
+        request_line = first + self.rfile.readline()
+        while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+            pass
+        self.server.record_arrival(request_line.decode('latin-1'), first_byte_at)
+        time.sleep(self.server.delay)
+        self.server.record_delivery()
+        body = b'{"code":200,"message":"success"}'
+        self.wfile.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                         b'Connection: close\r\nContent-Length: %d\r\n\r\n' % len(body) + body)
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        time.sleep(self.server.delay)
+        self.wfile.write(b'220 sim ESMTP\r\n')
+        first_byte_at = None
+        in_data = False
+        data = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if first_byte_at is None:
+                first_byte_at = time.perf_counter()
+            if in_data:
+                if line.rstrip(b'\r\n') == b'.':
+                    in_data = False
+                    self.server.record_delivery()
+                    # 只有完整送达的邮件才计为到达，步骤标记在（可能经过编码的）主题中
+                    subject = message_from_bytes(b''.join(data))['Subject'] or ''
+                    self.server.record_arrival(str(make_header(decode_header(subject))), first_byte_at)
+                    data = []
+                    self.wfile.write(b'250 OK\r\n')
+                else:
+                    data.append(line)
+                continue
+            command = line[:4].upper()
+            if command in (b'EHLO', b'HELO'):
+                self.wfile.write(b'250-sim\r\n250 AUTH PLAIN\r\n')
+            elif command == b'AUTH':
+                self.wfile.write(b'235 OK\r\n')
+            elif command == b'DATA':
+                in_data = True
+                self.wfile.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+            elif command == b'QUIT':
+                self.wfile.write(b'221 Bye\r\n')
+                return
+            else:
+                self.wfile.write(b'250 OK\r\n')
+
+
+def make_config(method, transport):
+    return {
+        'startup_enabled': False,
+        'shutdown_enabled': True,
+        'sleep_enabled': True,
+        'notification_method': method,
+        'bark': {
+            'server_url': f'http://127.0.0.1:{transport.port}/',
+            'device_key': 'sim'
+        },
+        'email': {
+            'smtp_server': '127.0.0.1',
+            'smtp_port': transport.port,
+            'sender': 'sim@localhost',
+            'password': 'sim',
+            'receiver': 'sim@localhost'
+        }
+    }
+
+
+class StepTagger:
+    # 步骤标记：simtag<场景运行序号>x<步骤序号>，运行序号保证不同场景运行的标记不会混淆
+    next_run_id = 0
+
+    def __init__(self):
+        StepTagger.next_run_id += 1
+        self.run_id = StepTagger.next_run_id
+
+    def tag(self, step):
+        return f"simtag{self.run_id}x{step}"
+
+
+def make_tagged_bus(main, tagger):
+    # 发布事件时记录触发它的消息所属的步骤；监听方在假实现回调它的线程中发布事件
+    class TaggedEventBus(main.EventBus):
+        def publish(self, event):
+            event.data['sim_tag'] = tagger.tag(current_step())
+            return super().publish(event)
+
+    return TaggedEventBus()
+
+
+def make_tagged_subscriber(main, notifier, config):
+    # 在通知标题中加入步骤标记，Bark 请求路径和邮件主题都会带上它
+    class TaggedNotificationSubscriber(main.NotificationSubscriber):
+        def format_message(self, event):
+            title, content = super().format_message(event)
+            return f"{title} {event.data.get('sim_tag')}", content
+
+    return TaggedNotificationSubscriber(notifier, config)
+
+
+def run_scenario(main, sim, transport, config, strategy, scenario, settle=0.5, drain=0.15, interval=None):
+    # 启动指定的监听策略，注入场景中的事件并记录延迟，按标题中的步骤标记（而不是到达顺序）
+    # 把到达的消息对应到事件。interval 为 None 时逐个注入，每个应当发送的事件等到送达后再注入下一个；
+    # 否则按固定间隔（秒，0 表示连续）注入全部事件，不等待送达，最后再统一等待
+    sim.reset()
+    main.ShutdownListener.class_registered = False
+    main.ShutdownListener.hwnd = None
+
+    tagger = StepTagger()
+    event_bus = make_tagged_bus(main, tagger)
+    event_bus.subscribe(make_tagged_subscriber(main, main.Notifier(config), config))
+    event_bus.start()
+    listener = main.ShutdownListener(event_bus, config)
+    listener.is_running = True
+    thread = threading.Thread(target=getattr(listener, STRATEGIES[strategy]), daemon=True)
+    thread.start()
+    # 等待监听方完成窗口/处理函数注册
+    ready = {
+        'wndproc': lambda: sim.gui.windows,
+        'wmi': lambda: True,
+        'console': lambda: sim.console.handlers,
+    }[strategy]
+    deadline = time.perf_counter() + 1
+    while not ready() and time.perf_counter() < deadline:
+        time.sleep(0.001)
+
+    steps = []
+    start = time.perf_counter()
+    for index, event in enumerate(SCENARIOS[scenario]):
+        if interval is not None:
+            delay = start + index * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        injected_at = time.perf_counter()
+        delivered = sim.deliver(strategy, event, index)
+        expected = delivered and event in SENDING_EVENTS
+        if expected and interval is None:
+            transport.wait_for_tag(tagger.tag(index), settle)
+        steps.append((index, event, injected_at, delivered, expected))
+
+    if interval is not None:
+        # 监听方逐个处理消息，每个应当发送的事件各自最多等待 settle 秒
+        for index, event, injected_at, delivered, expected in steps:
+            if expected:
+                transport.wait_for_tag(tagger.tag(index), settle)
+
+    # 给迟到和意外的发送留出时间（窗口消息方式每 100ms 处理一次消息）
+    time.sleep(drain)
+
+    traces = []
+    for index, event, injected_at, delivered, expected in steps:
+        arrivals = transport.get_arrivals(tagger.tag(index))
+        traces.append({
+            'strategy': strategy,
+            'scenario': scenario,
+            'step': index,
+            'event': event,
+            'interval_ms': None if interval is None else interval * 1000,
+            'delivered': delivered,
+            'expected': expected,
+            'sent': len(arrivals),
+            'latency_ms': round((min(arrivals) - injected_at) * 1000, 3) if arrivals else None,
+        })
+
+    listener.is_running = False
+    thread.join(timeout=2)
+    event_bus.stop()
+    return traces
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def summarize(traces):
+    # 按 策略/场景/事件 汇总发送次数和延迟分位数
+    groups = {}
+    for trace in traces:
+        key = (trace['strategy'], trace['scenario'], trace['step'], trace['event'])
+        groups.setdefault(key, []).append(trace)
+    lines = [f"{'策略':<8} {'场景':<10} {'步骤':<4} {'事件':<18} {'发送/次数':>9} {'p50(ms)':>9} {'p95(ms)':>9} {'max(ms)':>9}"]
+    for (strategy, scenario, step, event), group in groups.items():
+        latencies = [t['latency_ms'] for t in group if t['latency_ms'] is not None]
+        fmt = lambda v: '-' if v is None else f'{v:.1f}'
+        lines.append(f"{strategy:<10} {scenario:<12} {step:<6} {event:<20} "
+                     f"{sum(t['sent'] for t in group):>5}/{len(group):<5} "
+                     f"{fmt(percentile(latencies, 50)):>9} {fmt(percentile(latencies, 95)):>9} "
+                     f"{fmt(max(latencies) if latencies else None):>9}")
+    return '\n'.join(lines)
+
+
+def check_traces(traces):
+    # 检查每一步的发送次数：应当发送的事件恰好送达一次，其余事件不应发送，返回失败说明列表
+    failures = []
+    for trace in traces:
+        wanted = 1 if trace['expected'] else 0
+        if trace['sent'] != wanted:
+            failures.append(f"{trace['method']} {trace['strategy']} {trace['scenario']} 步骤 {trace['step']} "
+                            f"{trace['event']}: 应发送 {wanted} 次，实际 {trace['sent']} 次")
+    return failures
+
+
+def run(strategies=None, scenarios=None, methods=None, repeat=1, settle=0.5, drain=0.15, interval=None):
+    # 运行所有组合，返回逐事件的延迟记录
+    strategies = strategies or list(STRATEGIES)
+    scenarios = scenarios or list(SCENARIOS)
+    methods = methods or ['bark', 'email']
+    traces = []
+    with SimulatedWindows() as sim:
+        import main
+        import smtplib
+        # 本地 SMTP 替身不使用 TLS
+        saved_smtplib = main.smtplib
+        main.smtplib = types.SimpleNamespace(SMTP_SSL=smtplib.SMTP)
+        try:
+            for method in methods:
+                transport = TransportStandIn(BarkHandler if method == 'bark' else SmtpHandler).start()
+                try:
+                    config = make_config(method, transport)
+                    for _ in range(repeat):
+                        for strategy in strategies:
+                            for scenario in scenarios:
+                                for trace in run_scenario(main, sim, transport, config, strategy, scenario, settle, drain, interval):
+                                    trace['method'] = method
+                                    traces.append(trace)
+                finally:
+                    transport.stop()
+        finally:
+            main.smtplib = saved_smtplib
+    return traces
+
+
+def _wait_for_result(notifier, timeout=5):
+    # 结果在所有已启动的方式结束后才会记录
+    deadline = time.perf_counter() + timeout
+    while notifier.last_result is None and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    return notifier.last_result
+
+
+def run_hedge_checks(hedge_delay_ms=100, slow_delay=0.8):
+    # 检查推送链的对冲、取消和降级路径，返回 (检查项, 是否通过, 说明) 列表
+    checks = []
+    with SimulatedWindows():
+        import main
+        import smtplib
+        saved_smtplib = main.smtplib
+        main.smtplib = types.SimpleNamespace(SMTP_SSL=smtplib.SMTP)
+        try:
+            def make_chain_config(bark, email, primary, fallback):
+                config = make_config(primary, bark)
+                config['email'] = make_config('email', email)['email']
+                config['fallback_methods'] = [fallback]
+                config['hedge_delay_ms'] = hedge_delay_ms
+                return config
+
+            def check(name, result, conditions):
+                failed = [label for label, ok in conditions if not ok]
+                checks.append((name, not failed, '失败条件: ' + ', '.join(failed) if failed else json.dumps(result, ensure_ascii=False)))
+
+            # 对冲：Bark 慢但没有宕机，超过等待时间后邮件胜出；Bark 请求已发出无法取消，领先时间按 Bark 实际完成时间计算
+            bark = TransportStandIn(BarkHandler, delay=slow_delay).start()
+            email = TransportStandIn(SmtpHandler).start()
+            notifier = main.Notifier(make_chain_config(bark, email, 'bark', 'email'))
+            sent = notifier.send_notification('hedge', 'check')
+            result = _wait_for_result(notifier, slow_delay + 5)
+            attempts = {a['method']: a for a in result['attempts']} if result else {}
+            check('hedge', result, [
+                ('发送成功', sent),
+                ('邮件胜出', result and result['winner'] == 'email'),
+                ('邮件为对冲发送', attempts.get('email', {}).get('reason') == 'hedge'),
+                ('对冲在等待时间后启动', result and result['hedge_started_ms'] is not None
+                 and result['hedge_started_ms'] >= hedge_delay_ms),
+                ('Bark 最终送达', attempts.get('bark', {}).get('status') == 'success'),
+                ('领先时间按 Bark 完成时间计算', result and result['runner_up'] == 'bark' and result['margin_ms'] is not None
+                 and abs(result['margin_ms'] - (attempts['bark']['finished_ms'] - attempts['email']['finished_ms'])) < 0.2),
+            ])
+            bark.stop()
+            email.stop()
+
+            # 取消：邮件服务慢，对冲的 Bark 先成功，邮件在登录后被取消，不会送达
+            bark = TransportStandIn(BarkHandler).start()
+            email = TransportStandIn(SmtpHandler, delay=slow_delay).start()
+            notifier = main.Notifier(make_chain_config(bark, email, 'email', 'bark'))
+            sent = notifier.send_notification('cancel', 'check')
+            result = _wait_for_result(notifier, slow_delay + 5)
+            attempts = {a['method']: a for a in result['attempts']} if result else {}
+            check('cancel', result, [
+                ('发送成功', sent),
+                ('Bark 胜出', result and result['winner'] == 'bark'),
+                ('邮件被取消', attempts.get('email', {}).get('status') == 'cancelled'),
+                ('邮件没有送达', email.delivered == 0),
+                ('没有可比较的领先时间', result and result['runner_up'] == 'email' and result['margin_ms'] is None),
+            ])
+            bark.stop()
+            email.stop()
+
+            # 降级：Bark 无法连接，立即改用邮件
+            bark = TransportStandIn(BarkHandler).start()
+            bark.stop()
+            email = TransportStandIn(SmtpHandler).start()
+            notifier = main.Notifier(make_chain_config(bark, email, 'bark', 'email'))
+            sent = notifier.send_notification('fallback', 'check')
+            result = _wait_for_result(notifier)
+            attempts = {a['method']: a for a in result['attempts']} if result else {}
+            check('fallback', result, [
+                ('发送成功', sent),
+                ('邮件胜出', result and result['winner'] == 'email'),
+                ('邮件为降级发送', attempts.get('email', {}).get('reason') == 'fallback'),
+                ('Bark 失败', attempts.get('bark', {}).get('status') == 'failed'),
+                ('第二名为失败的 Bark', result and result['runner_up'] == 'bark' and result['margin_ms'] is None),
+            ])
+            email.stop()
+        finally:
+            main.smtplib = saved_smtplib
+    return checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在模拟的 Windows 消息路径上回放关机事件并记录通知延迟")
+    parser.add_argument('--strategy', action='append', choices=list(STRATEGIES), help="监听策略，可重复指定，默认全部")
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS), help="事件场景，可重复指定，默认全部")
+    parser.add_argument('--method', action='append', choices=['bark', 'email'], help="推送方式，可重复指定，默认全部")
+    parser.add_argument('--repeat', type=int, default=1, help="每个组合重复次数")
+    parser.add_argument('--settle', type=float, default=0.5, help="应当发送通知的事件等待发送的最长时间(秒)")
+    parser.add_argument('--drain', type=float, default=0.15, help="每个场景结束后等待迟到或意外发送的时间(秒)")
+    parser.add_argument('--interval', type=float, help="按固定间隔注入事件(秒，0 表示连续注入)，不等待送达；默认逐个注入并等待送达")
+    parser.add_argument('--trace', action='store_true', help="把逐事件记录写入 logs 目录")
+    parser.add_argument('--hedge', action='store_true', help="只检查推送链的对冲、取消和降级路径")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.hedge:
+        checks = run_hedge_checks()
+        for name, ok, detail in checks:
+            print(f"{'通过' if ok else '失败'} {name}: {detail}")
+        sys.exit(0 if all(ok for _, ok, _ in checks) else 1)
+
+    traces = run(args.strategy, args.scenario, args.method, args.repeat, args.settle, args.drain, args.interval)
+
+    for method in sorted({t['method'] for t in traces}):
+        print(f"\n推送方式: {method}")
+        print(summarize([t for t in traces if t['method'] == method]))
+
+    if args.trace:
+        log_dir = Path(os.path.dirname(os.path.abspath(__file__))) / 'logs'
+        log_dir.mkdir(exist_ok=True)
+        trace_file = log_dir / f"sim_trace_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+        with open(trace_file, 'w', encoding='utf-8') as f:
+            for trace in traces:
+                f.write(json.dumps(trace, ensure_ascii=False) + '\n')
+        print(f"\n延迟记录已写入: {trace_file}")
+
+    failures = check_traces(traces)
+    if failures:
+        print(f"\n发送次数不符合预期 ({len(failures)} 处):")
+        for failure in failures:
+            print(f"  {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()